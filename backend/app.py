@@ -1,29 +1,44 @@
+import json
 import os
 import re
-import unicodedata
-from typing import List, Optional, Dict, Any, Set
+from typing import List, Optional, Dict, Any, Set, FrozenSet, Tuple
 from collections import defaultdict
+from contextlib import asynccontextmanager
+from functools import partial
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import anyio
+import msgspec
+import orjson
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import JSONResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
 
 from rag.parsers import parse_file
-from rag.text_utils import chunk_text
+from rag.text_utils import (
+    chunk_text_stream,
+    fold_text,
+    keyword_tokens,
+    token_bloom,
+    bloom_may_overlap,
+)
 from rag.store import (
     add_chunks,
     query_top_k,
+    query_kv_key,
     delete_file_chunks,
     list_indexed_files,
     clear_index,
     count_chunks,
 )
-from rag.ollama_client import chat_answer
+from rag.ollama_client import chat_answer, aclose as close_ollama_client
 
 BASE_DIR = os.path.dirname(__file__)
 UPLOAD_DIR = os.path.join(BASE_DIR, "storage", "uploads")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+UPLOAD_BUF_SIZE = 1 << 20  # 1 MiB
+
 NO_ANSWER = "Je ne trouve pas la réponse dans les documents fournis."
 
 # ----------------------------
@@ -58,7 +73,7 @@ MAX_CONTEXT_CHARS = _env_int("RAG_MAX_CONTEXT_CHARS", 7000)
 
 # ZÉRO-FAUX: seuil minimal de “preuve” lexicale
 MIN_OVERLAP = _env_int("RAG_MIN_OVERLAP", 1)       # 1 = tolérant, 2 = plus strict
-MIN_KEYWORD_LEN = _env_int("RAG_MIN_KW_LEN", 4)    # mots >= 4, sauf exceptions ci-dessous
+# (RAG_MIN_KW_LEN est lu dans rag/text_utils.py: les tokens sont calculés à l'indexation)
 
 # Étape 9 (optionnel): mode 100% extractif (ne jamais reformuler)
 EXTRACTIVE_ONLY = _env_int("RAG_EXTRACTIVE_ONLY", 0)          # 1=ON, 0=OFF
@@ -68,7 +83,31 @@ EXTRACTIVE_MAX = _env_int("RAG_EXTRACTIVE_MAX", 2)            # nb d'extraits re
 VERBATIM_ONLY = _env_int("RAG_VERBATIM_ONLY", 0)              # 1=ON, 0=OFF
 VERBATIM_MIN_SENT_CHARS = _env_int("RAG_VERBATIM_MIN_CHARS", 20)
 
-app = FastAPI(title="Chat with your Docs (RAG) - Local")
+# Travail CPU de /chat (tokenisation, sélection des hits, vérif VERBATIM) hors de la boucle d'événements,
+# sur un limiteur dédié: ne concurrence pas le threadpool par défaut (uploads, parsing, écritures d'index)
+CPU_WORKERS = _env_int("RAG_CPU_WORKERS", 4)
+_cpu_limiter = anyio.CapacityLimiter(max(1, CPU_WORKERS))
+
+class ORJSONResponse(JSONResponse):
+    """
+    Réponses JSON sérialisées par orjson (plus rapide que json.dumps).
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    await close_ollama_client()
+
+
+app = FastAPI(
+    title="Chat with your Docs (RAG) - Local",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -80,91 +119,91 @@ app.add_middleware(
 # ----------------------------
 # Models
 # ----------------------------
-class ChatMsg(BaseModel):
-    role: str = Field(..., description="user|assistant")
+# msgspec (décodage JSON + validation en une passe), décodés à la main dans les routes
+class ChatMsg(msgspec.Struct):
+    role: str  # user|assistant
     content: str
 
 
-class ChatIn(BaseModel):
+class ChatIn(msgspec.Struct):
     message: str
     top_k: int = 5
-    history: List[ChatMsg] = Field(default_factory=list)
+    history: List[ChatMsg] = msgspec.field(default_factory=list)
     selected_files: Optional[List[str]] = None
 
 
+_chat_decoder = msgspec.json.Decoder(ChatIn, strict=False)
+
+
 # ----------------------------
-# Normalization + tokenization (mots entiers)
+# Lexical tokens (cache par chunk)
 # ----------------------------
-def _fold(s: str) -> str:
-    if not s:
-        return ""
-    s = s.lower()
-    s = unicodedata.normalize("NFKD", s)
-    s = "".join(ch for ch in s if not unicodedata.combining(ch))
-    s = re.sub(r"[^a-z0-9\s]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
-
-
-_STOPWORDS_FR = {
-    "cest","c","est","qui","quoi","que","qu","de","des","du","la","le","les","un","une","et","ou","a","à",
-    "au","aux","dans","sur","pour","par","en","ce","cet","cette","ces","mon","ma","mes","ton","ta","tes","son","sa",
-    "ses","leur","leurs","avec","sans","plus","moins","d","l","y","il","elle","on","nous","vous","ils","elles",
-    "definir","donne","donner","explique","expliquer","svp","stp"
-}
-
-# exceptions courtes utiles (AJOUT tel, rag)
-_SHORT_KEEP = {"ia", "ml", "dl", "cv", "rag", "tel"}
-
-
-def _tokens(text: str) -> Set[str]:
-    t = _fold(text)
-    if not t:
-        return set()
-    toks = set()
-    for w in t.split():
-        if not w:
-            continue
-        if w in _STOPWORDS_FR:
-            continue
-        if len(w) < MIN_KEYWORD_LEN and w not in _SHORT_KEEP:
-            continue
-        toks.add(w)
-    return toks
+def _hit_tokens(hit: Dict[str, Any]) -> FrozenSet[str]:
+    """
+    Tokens du chunk, pré-calculés à l'indexation (meta "tokens", séparés par des espaces).
+    """
+    return frozenset(hit["meta"]["tokens"].split())
 
 
-def _overlap_words(q_tokens: Set[str], doc_tokens: Set[str]) -> int:
-    if not q_tokens or not doc_tokens:
-        return 0
-    return len(q_tokens.intersection(doc_tokens))
+def _hit_folded(hit: Dict[str, Any]) -> str:
+    """
+    Texte du chunk passé par fold_text, calculé une seule fois par requête (mémorisé sur le hit).
+    """
+    folded = hit.get("_folded")
+    if folded is None:
+        folded = fold_text(hit.get("doc") or "")
+        hit["_folded"] = folded
+    return folded
 
 
 # ----------------------------
 # Helpers: key/value extraction
 # ----------------------------
-KV_LINE_RE = re.compile(r"^\s*([A-Z][A-Z0-9_]{2,})\s*:\s*(.+?)\s*$")
 KEY_IN_TEXT_RE = re.compile(r"\b([A-Z][A-Z0-9_]{2,})\b")
+_KEY_NUM_SUFFIX_RE = re.compile(r"^(.*?)(\d+)$")
+
+
+def _hit_kv(hit: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Paires KEY: valeur du chunk, pré-calculées à l'indexation (meta "kv", JSON, "" si aucune).
+    Mémorisées sur le hit pour la durée de la requête.
+    """
+    kv = hit.get("_kv")
+    if kv is None:
+        cached = hit["meta"]["kv"]
+        kv = json.loads(cached) if cached else {}
+        hit["_kv"] = kv
+    return kv
+
+
+EXCERPT_CHARS = 300
 
 
-def extract_kv_pairs(text: str) -> Dict[str, str]:
-    out: Dict[str, str] = {}
-    for line in text.splitlines():
-        m = KV_LINE_RE.match(line)
-        if m:
-            key = m.group(1).strip()
-            val = m.group(2).strip()
-            out[key] = val
-    return out
+def _hit_source(hit: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Entrée "sources" de la réponse pour un hit. L'extrait (blancs et sauts de ligne réduits à un espace)
+    est calculé une seule fois et mémorisé sur le hit: mêmes extraits quelle que soit la branche de /chat.
+    """
+    excerpt = hit.get("_excerpt")
+    if excerpt is None:
+        excerpt = " ".join((hit.get("doc") or "")[:EXCERPT_CHARS].split())
+        hit["_excerpt"] = excerpt
+    meta = hit.get("meta") or {}
+    return {
+        "file": meta.get("file_name", "unknown"),
+        "chunk": meta.get("chunk_index", -1),
+        "distance": hit.get("distance"),
+        "excerpt": excerpt,
+    }
 
 
 def keys_in_hits(hits: List[Dict[str, Any]]) -> List[str]:
-    found = []
+    # dict = ensemble ordonné (ordre de première apparition), dédoublonnage en O(1)
+    found: Dict[str, None] = {}
     for h in hits:
-        kv = extract_kv_pairs(h.get("doc", "") or "")
-        for k in kv.keys():
-            if k not in found:
-                found.append(k)
-    return found
+        for k in _hit_kv(h):
+            found[k] = None
+    return list(found)
 
 
 def resolve_requested_key(message: str, history: List[ChatMsg], hits: List[Dict[str, Any]]) -> Optional[str]:
@@ -184,7 +223,7 @@ def resolve_requested_key(message: str, history: List[ChatMsg], hits: List[Dict[
                 break
 
         if last_key:
-            mm = re.match(r"^(.*?)(\d+)$", last_key)
+            mm = _KEY_NUM_SUFFIX_RE.match(last_key)
             if mm:
                 prefix = mm.group(1)
                 num = mm.group(2)
@@ -208,7 +247,7 @@ def resolve_requested_key(message: str, history: List[ChatMsg], hits: List[Dict[
 
 def find_value_for_key(key: str, hits: List[Dict[str, Any]]) -> Optional[str]:
     for h in hits:
-        kv = extract_kv_pairs(h.get("doc", "") or "")
+        kv = _hit_kv(h)
         if key in kv:
             return kv[key]
     return None
@@ -221,6 +260,8 @@ _EXACT_TRIGGER_RE = re.compile(
     r"\b(exact|exacte|exactement|uniquement|seulement|juste|valeur|retourne|donne|affiche|output|print)\b",
     flags=re.IGNORECASE,
 )
+_BARE_KEY_RE = re.compile(r"[A-Z][A-Z0-9_]{2,}")
+_DONNE_KEY_RE = re.compile(r"^\s*(donne|affiche|retourne)\s+[A-Z][A-Z0-9_]{2,}\s*\??\s*$", flags=re.IGNORECASE)
 
 
 def _is_exact_request(message: str) -> bool:
@@ -232,7 +273,7 @@ def _is_exact_request(message: str) -> bool:
         return False
 
     # Si le message est juste une clé
-    if re.fullmatch(r"[A-Z][A-Z0-9_]{2,}", m):
+    if _BARE_KEY_RE.fullmatch(m):
         return True
 
     # S'il y a une clé dans le texte + trigger
@@ -240,7 +281,7 @@ def _is_exact_request(message: str) -> bool:
         return True
 
     # Cas "donne/affiche/retourne KEY"
-    if re.search(r"^\s*(donne|affiche|retourne)\s+[A-Z][A-Z0-9_]{2,}\s*\??\s*$", m, flags=re.IGNORECASE):
+    if _DONNE_KEY_RE.search(m):
         return True
 
     return False
@@ -249,46 +290,67 @@ def _is_exact_request(message: str) -> bool:
 # ----------------------------
 # RAG post-processing
 # ----------------------------
-def _apply_distance_threshold(hits: List[Dict[str, Any]], max_distance: float) -> List[Dict[str, Any]]:
-    if max_distance is None or max_distance <= 0:
-        return hits
-    out = []
-    for h in hits:
-        d = h.get("distance")
-        if d is None or d <= max_distance:
-            out.append(h)
-    return out
-
-
-def _trim_hits(
+def _select_hits(
     hits: List[Dict[str, Any]],
+    q_toks: FrozenSet[str],
+    max_distance: float,
+    min_overlap: int,
     max_chunks: int,
     max_per_file: int,
     max_chars: int,
-) -> List[Dict[str, Any]]:
-    per_file = defaultdict(int)
-    kept = []
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Une seule passe sur les hits (déjà triés best-first par query_top_k):
+    seuil de distance, overlap lexical et trim (nb chunks / par fichier / caractères).
+    Retourne (hits gardés, meilleur overlap observé).
+    Arrêt anticipé dès que le trim est complet ET que min_overlap est atteint: la queue des hits
+    n'est alors pas scorée (le meilleur overlap retourné est un minorant, suffisant pour le gate).
+    """
+    # pré-filtre bloom (vectorisé): les hits sans bit commun ont overlap = 0
+    may_overlap = bloom_may_overlap(
+        token_bloom(q_toks),
+        [h["bloom"] for h in hits],
+    )
+
+    per_file: Dict[str, int] = defaultdict(int)
+    kept: List[Dict[str, Any]] = []
     total = 0
+    best_ov = 0
+    trim_done = False
 
-    for h in hits:
-        meta = h.get("meta") or {}
-        fn = meta.get("file_name", "unknown")
-        doc = (h.get("doc") or "").strip()
-        if not doc:
+    for h, may in zip(hits, may_overlap):
+        if trim_done and best_ov >= min_overlap:
+            break
+
+        d = h.get("distance")
+        if max_distance and max_distance > 0 and d is not None and d > max_distance:
             continue
 
+        ov = len(q_toks & _hit_tokens(h)) if may else 0
+        if ov > best_ov:
+            best_ov = ov
+
+        # Garder seulement ceux qui ont overlap > 0 (évite mélange CV/pdf)
+        if ov <= 0 or trim_done:
+            continue
+
+        fn = (h.get("meta") or {}).get("file_name", "unknown")
+        doc_len = len((h.get("doc") or "").strip())
+        if not doc_len:
+            continue
         if per_file[fn] >= max_per_file:
             continue
-        if len(kept) >= max_chunks:
-            break
-        if total + len(doc) > max_chars:
-            break
+        if len(kept) >= max_chunks or total + doc_len > max_chars:
+            trim_done = True
+            continue
 
         kept.append(h)
         per_file[fn] += 1
-        total += len(doc)
+        total += doc_len
+        if len(kept) >= max_chunks:
+            trim_done = True
 
-    return kept
+    return kept, best_ov
 
 
 # ----------------------------
@@ -299,14 +361,17 @@ _REFUSAL_PATTERNS = [
     r"\bje n['’]ai pas trouv[ée]?\b",
     r"\bpas dans les documents\b",
 ]
+_REFUSAL_RES = [re.compile(p, flags=re.IGNORECASE) for p in _REFUSAL_PATTERNS]
+_NO_ANSWER_FOLDED = fold_text(NO_ANSWER)
+_SENT_SPLIT_RE = re.compile(r"[.!?\n]+")
 
 
 def _looks_like_refusal(answer: str) -> bool:
-    a = _fold(answer)
-    if _fold(NO_ANSWER) in a:
+    a = fold_text(answer)
+    if _NO_ANSWER_FOLDED in a:
         return True
-    for pat in _REFUSAL_PATTERNS:
-        if re.search(pat, a, flags=re.IGNORECASE):
+    for pat in _REFUSAL_RES:
+        if pat.search(a):
             return True
     return False
 
@@ -315,7 +380,7 @@ def _split_sentences(text: str) -> List[str]:
     t = (text or "").strip()
     if not t:
         return []
-    parts = re.split(r"[.!?\n]+", t)
+    parts = _SENT_SPLIT_RE.split(t)
     return [p.strip() for p in parts if p and p.strip()]
 
 
@@ -327,17 +392,20 @@ def _verbatim_ok(answer: str, hits: List[Dict[str, Any]]) -> bool:
     if not VERBATIM_ONLY:
         return True
 
-    src = _fold("\n".join([(h.get("doc") or "") for h in hits]))
+    # == fold_text("\n".join(docs)): fold_text réduit tout séparateur à un espace
+    src = " ".join(f for f in (_hit_folded(h) for h in hits) if f)
     if not src:
         return False
 
+    needles = set()
     for s in _split_sentences(answer):
         if len(s) < VERBATIM_MIN_SENT_CHARS:
             continue
-        sf = _fold(s)
-        if sf and sf not in src:
-            return False
-    return True
+        sf = fold_text(s)
+        if sf:
+            needles.add(sf)
+    # phrases dédoublonnées; `in` (recherche C) reste plus rapide qu'un automate construit par requête
+    return all(sf in src for sf in needles)
 
 
 def _extractive_answer_from_sources(sources: List[Dict[str, Any]]) -> str:
@@ -403,15 +471,16 @@ async def upload_document(file: UploadFile = File(...)):
 
     filename = os.path.basename(filename)
     path = os.path.join(UPLOAD_DIR, filename)
+    # copie par blocs (évite de charger tout le fichier en mémoire)
     with open(path, "wb") as f:
-        f.write(await file.read())
+        while chunk := await file.read(UPLOAD_BUF_SIZE):
+            f.write(chunk)
 
-    text = parse_file(path)
-    if not text or not text.strip():
+    # pages -> chunks (parsing/chunking dans le threadpool) -> embeddings par lots concurrents
+    chunks = chunk_text_stream(parse_file(path), chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
+    n = await add_chunks(filename, iterate_in_threadpool(chunks))
+    if not n:
         raise HTTPException(400, "No text extracted (PDF may be scanned).")
-
-    chunks = chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP)
-    n = add_chunks(filename, chunks)
     return {
         "file_name": filename,
         "chunks_indexed": n,
@@ -421,7 +490,12 @@ async def upload_document(file: UploadFile = File(...)):
 
 
 @app.post("/chat")
-def chat(payload: ChatIn):
+async def chat(request: Request):
+    try:
+        payload = _chat_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:  # ValidationError en hérite
+        raise HTTPException(422, str(e))
+
     question = (payload.message or "").strip()
     if not question:
         raise HTTPException(400, "Missing message.")
@@ -432,50 +506,40 @@ def chat(payload: ChatIn):
     selected: Set[str] = set(payload.selected_files or [])
     where = {"file_name": {"$in": sorted(selected)}} if selected else None
 
-    # 1) Retrieve
-    hits_all = query_top_k(question, k=retrieve_k, where=where)
+    # 0) Question = une clé seule (ex: "TEL_001"): lecture directe des paires KEY: valeur indexées,
+    #    sans embedding ni recherche vectorielle
+    if _BARE_KEY_RE.fullmatch(question):
+        key_hits = await run_in_threadpool(query_kv_key, question, min(MAX_CHUNKS, final_top_k), where)
+        val = find_value_for_key(question, key_hits)
+        if val is None:
+            return {"answer": NO_ANSWER, "sources": []}
+        return {"answer": val, "sources": [_hit_source(h) for h in key_hits]}
 
-    # 2) Distance threshold (optional)
-    hits_dist = _apply_distance_threshold(hits_all, MAX_DISTANCE)
+    # 1) Retrieve
+    hits_all = await query_top_k(question, k=retrieve_k, where=where)
 
-    if not hits_dist:
+    if not hits_all:
         return {"answer": NO_ANSWER, "sources": []}
 
-    # 3) Lexical proof gate (word overlap)
-    q_toks = _tokens(question)
-
-    scored = []
-    best_ov = 0
-    for h in hits_dist:
-        doc = h.get("doc") or ""
-        ov = _overlap_words(q_toks, _tokens(doc))
-        hh = dict(h)
-        hh["_ov"] = ov
-        scored.append(hh)
-        if ov > best_ov:
-            best_ov = ov
+    # 2-4) Distance threshold (optional) + lexical proof gate (word overlap) + trim
+    hits_trimmed, best_ov = await anyio.to_thread.run_sync(
+        partial(
+            _select_hits,
+            hits_all,
+            frozenset(keyword_tokens(question)),
+            max_distance=MAX_DISTANCE,
+            min_overlap=MIN_OVERLAP,
+            max_chunks=min(MAX_CHUNKS, final_top_k),
+            max_per_file=MAX_PER_FILE,
+            max_chars=MAX_CONTEXT_CHARS,
+        ),
+        limiter=_cpu_limiter,
+    )
 
     # Si aucun chunk n'a un overlap suffisant => NO_ANSWER (ZÉRO-FAUX)
     if best_ov < MIN_OVERLAP:
         return {"answer": NO_ANSWER, "sources": []}
 
-    # Garder seulement ceux qui ont overlap > 0 (évite mélange CV/pdf)
-    scored = [h for h in scored if h.get("_ov", 0) > 0]
-
-    # Retirer clé interne et trier (best-first: distance)
-    for h in scored:
-        if "_ov" in h:
-            del h["_ov"]
-    scored.sort(key=lambda h: (h.get("distance") is None, h.get("distance") if h.get("distance") is not None else 10**9))
-
-    # 4) Trim
-    hits_trimmed = _trim_hits(
-        scored,
-        max_chunks=min(MAX_CHUNKS, final_top_k),
-        max_per_file=MAX_PER_FILE,
-        max_chars=MAX_CONTEXT_CHARS,
-    )
-
     if not hits_trimmed:
         return {"answer": NO_ANSWER, "sources": []}
 
@@ -487,11 +551,9 @@ def chat(payload: ChatIn):
         fn = meta.get("file_name", "unknown")
         ci = meta.get("chunk_index", -1)
         doc = h.get("doc") or ""
-        dist = h.get("distance")
-        excerpt = (doc[:300] if doc else "").replace("\n", " ").strip()
 
         context_lines.append(f"[{fn} | chunk {ci}] {doc}")
-        sources.append({"file": fn, "chunk": ci, "distance": dist, "excerpt": excerpt})
+        sources.append(_hit_source(h))
 
     # ----------------------------
     # Étape 8: réponse exacte (KEY -> valeur) + sources filtrées
@@ -505,22 +567,7 @@ def chat(payload: ChatIn):
                 return {"answer": NO_ANSWER, "sources": []}
 
             # Ne garder que les sources qui contiennent vraiment la clé
-            filtered_sources = []
-            for h in hits_trimmed:
-                kv = extract_kv_pairs(h.get("doc", "") or "")
-                if key in kv:
-                    meta = h.get("meta") or {}
-                    fn = meta.get("file_name", "unknown")
-                    ci = meta.get("chunk_index", -1)
-                    doc = h.get("doc") or ""
-                    filtered_sources.append(
-                        {
-                            "file": fn,
-                            "chunk": ci,
-                            "distance": h.get("distance"),
-                            "excerpt": (doc[:300].replace("\n", " ").strip()),
-                        }
-                    )
+            filtered_sources = [_hit_source(h) for h in hits_trimmed if key in _hit_kv(h)]
 
             return {"answer": val, "sources": filtered_sources}
         # si "exact" mais pas de clé explicite, on continue en mode normal
@@ -530,22 +577,7 @@ def chat(payload: ChatIn):
     if requested_key:
         val = find_value_for_key(requested_key, hits_trimmed)
         if val is not None:
-            filtered_sources = []
-            for h in hits_trimmed:
-                kv = extract_kv_pairs(h.get("doc", "") or "")
-                if requested_key in kv:
-                    meta = h.get("meta") or {}
-                    fn = meta.get("file_name", "unknown")
-                    ci = meta.get("chunk_index", -1)
-                    doc = h.get("doc") or ""
-                    filtered_sources.append(
-                        {
-                            "file": fn,
-                            "chunk": ci,
-                            "distance": h.get("distance"),
-                            "excerpt": (doc[:300].replace("\n", " ").strip()),
-                        }
-                    )
+            filtered_sources = [_hit_source(h) for h in hits_trimmed if requested_key in _hit_kv(h)]
             return {"answer": val, "sources": filtered_sources}
 
     # ----------------------------
@@ -576,7 +608,7 @@ def chat(payload: ChatIn):
         prompt_context += f"Historique:\n{history_block}\n\n"
     prompt_context += "Sources:\n" + "\n\n".join(context_lines)
 
-    raw = chat_answer(system, question, prompt_context)
+    raw = await chat_answer(system, question, prompt_context)
     answer = (raw or "").strip() or NO_ANSWER
 
     # 6) Post-check final (anti “Je ne trouve pas… mais …”)
@@ -584,7 +616,7 @@ def chat(payload: ChatIn):
         return {"answer": NO_ANSWER, "sources": []}
 
     # 7) Option VERBATIM_ONLY: chaque phrase doit exister dans les sources
-    if not _verbatim_ok(answer, hits_trimmed):
+    if VERBATIM_ONLY and not await anyio.to_thread.run_sync(_verbatim_ok, answer, hits_trimmed, limiter=_cpu_limiter):
         return {"answer": NO_ANSWER, "sources": []}
 
     return {"answer": answer, "sources": sources}
@@ -1,57 +1,94 @@
 # backend/rag/ollama_client.py
+import asyncio
 import os
-import requests
-from typing import List
+from typing import Iterator, List
+
+import httpx
 
 DEFAULT_OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11434")
 DEFAULT_CHAT_MODEL = os.getenv("OLLAMA_CHAT_MODEL", "llama3.1:8b")
 DEFAULT_EMBED_MODEL = os.getenv("OLLAMA_EMBED_MODEL", "nomic-embed-text")
 
+EMBED_BATCH_SIZE = 64      # taille des lots envoyés à /api/embed
+EMBED_WORKERS = 8          # requêtes d'embedding simultanées par file (lots ou fallback /api/embeddings)
+
+# Client async partagé: connexions keep-alive réutilisées, requêtes concurrentes sans bloquer la boucle
+_client = httpx.AsyncClient(
+    timeout=120,
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+)
+# Deux files séparées: l'embedding d'une question ne fait jamais la queue derrière les lots d'un upload
+_embed_slots = asyncio.Semaphore(EMBED_WORKERS)
+_query_slots = asyncio.Semaphore(EMBED_WORKERS)
+
+
+async def aclose() -> None:
+    await _client.aclose()
 
-def _post(url: str, payload: dict, timeout: int = 120) -> dict:
-    r = requests.post(url, json=payload, timeout=timeout)
+
+async def _post(url: str, payload: dict, timeout: int = 120) -> dict:
+    r = await _client.post(url, json=payload, timeout=timeout)
     r.raise_for_status()
     return r.json()
 
 
-def embed_texts(texts: List[str], base_url: str = DEFAULT_OLLAMA_URL, model: str = DEFAULT_EMBED_MODEL) -> List[List[float]]:
+async def embed_texts(texts: List[str], base_url: str = DEFAULT_OLLAMA_URL, model: str = DEFAULT_EMBED_MODEL, query: bool = False) -> List[List[float]]:
     """
     Retourne une liste d'embeddings (List[float]) pour chaque texte.
     Compatible avec /api/embed (nouveau) et /api/embeddings (ancien).
+    Les lots sont envoyés en parallèle (au plus EMBED_WORKERS requêtes simultanées).
+    query=True: file réservée aux questions, indépendante des lots d'indexation.
     """
     texts = [t if isinstance(t, str) else str(t) for t in texts]
     texts = [t.strip() for t in texts if t and t.strip()]
     if not texts:
         return []
 
+    results = await asyncio.gather(
+        *(_embed_batch(batch, base_url, model, _query_slots if query else _embed_slots) for batch in _batches(texts, EMBED_BATCH_SIZE))
+    )
+    out: List[List[float]] = []
+    for embs in results:
+        out.extend(embs)
+    return out
+
+
+def _batches(items: List[str], size: int) -> Iterator[List[str]]:
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+async def _embed_batch(texts: List[str], base_url: str, model: str, slots: asyncio.Semaphore) -> List[List[float]]:
     # 1) Essaye /api/embed (moderne): {model, input:[...]} -> {embeddings:[...]}
     try:
-        data = _post(f"{base_url}/api/embed", {"model": model, "input": texts}, timeout=120)
+        async with slots:
+            data = await _post(f"{base_url}/api/embed", {"model": model, "input": texts}, timeout=120)
         embs = data.get("embeddings")
-        if isinstance(embs, list) and embs and isinstance(embs[0], list):
+        if isinstance(embs, list) and len(embs) == len(texts) and isinstance(embs[0], list):
             return embs
     except Exception:
         pass
 
-    # 2) Fallback /api/embeddings (ancien): {model, prompt:"..."} -> {embedding:[...]} (un par un)
-    out: List[List[float]] = []
-    for t in texts:
-        data = _post(f"{base_url}/api/embeddings", {"model": model, "prompt": t}, timeout=120)
+    # 2) Fallback /api/embeddings (ancien): {model, prompt:"..."} -> {embedding:[...]} (un par un, en parallèle)
+    async def embed_one(t: str) -> List[float]:
+        async with slots:
+            data = await _post(f"{base_url}/api/embeddings", {"model": model, "prompt": t}, timeout=120)
         emb = data.get("embedding")
         if not isinstance(emb, list):
             raise RuntimeError("Ollama embeddings: format inattendu.")
-        out.append(emb)
-    return out
+        return emb
+
+    return list(await asyncio.gather(*(embed_one(t) for t in texts)))
 
 
-def chat_answer(system: str, user_question: str, context: str, base_url: str = DEFAULT_OLLAMA_URL, model: str = DEFAULT_CHAT_MODEL) -> str:
+async def chat_answer(system: str, user_question: str, context: str, base_url: str = DEFAULT_OLLAMA_URL, model: str = DEFAULT_CHAT_MODEL) -> str:
     # 1) /api/chat
     try:
         messages = [
             {"role": "system", "content": system},
             {"role": "user", "content": f"SOURCES:\n{context}\n\nQUESTION: {user_question}\n\nRéponse:"},
         ]
-        data = _post(f"{base_url}/api/chat", {"model": model, "messages": messages, "stream": False}, timeout=120)
+        data = await _post(f"{base_url}/api/chat", {"model": model, "messages": messages, "stream": False}, timeout=120)
         msg = data.get("message", {})
         content = msg.get("content")
         if isinstance(content, str) and content.strip():
@@ -61,6 +98,6 @@ def chat_answer(system: str, user_question: str, context: str, base_url: str = D
 
     # 2) fallback /api/generate
     prompt = f"{system}\n\nSOURCES:\n{context}\n\nQUESTION: {user_question}\n\nRéponse:"
-    data = _post(f"{base_url}/api/generate", {"model": model, "prompt": prompt, "stream": False}, timeout=120)
+    data = await _post(f"{base_url}/api/generate", {"model": model, "prompt": prompt, "stream": False}, timeout=120)
     resp = data.get("response", "")
     return resp.strip() if isinstance(resp, str) else str(resp)
@@ -1,19 +1,28 @@
+from typing import Iterator
+
 from pypdf import PdfReader
 from docx import Document
 
-def parse_pdf(path: str) -> str:
+def parse_pdf(path: str) -> Iterator[str]:
+    # page par page: le texte complet n'est jamais matérialisé
     reader = PdfReader(path)
-    return "\n".join([(p.extract_text() or "") for p in reader.pages]).strip()
+    for p in reader.pages:
+        yield p.extract_text() or ""
 
-def parse_docx(path: str) -> str:
+def parse_docx(path: str) -> Iterator[str]:
     doc = Document(path)
-    return "\n".join([p.text for p in doc.paragraphs]).strip()
+    for p in doc.paragraphs:
+        yield p.text
 
-def parse_txt(path: str) -> str:
+def parse_txt(path: str) -> Iterator[str]:
     with open(path, "r", encoding="utf-8", errors="ignore") as f:
-        return f.read().strip()
+        yield f.read().strip()
 
-def parse_file(path: str) -> str:
+def parse_file(path: str) -> Iterator[str]:
+    """
+    Retourne un itérateur de morceaux de texte (pages pour un PDF), à joindre par "\\n"
+    (voir text_utils.chunk_text_stream).
+    """
     p = path.lower()
     if p.endswith(".pdf"):
         return parse_pdf(path)
@@ -1,29 +1,530 @@
 # backend/rag/store.py
+"""
+Index vectoriel local "à plat" (remplace ChromaDB).
+
+L'index est une suite de segments en ajout seul (storage/flat/), un segment par upload:
+  - embs.<seg>.npy   : embeddings float32 (n, D), ouverts en memmap (rerank exact)
+  - embs8.<seg>.npy  : embeddings L2-normalisés quantifiés int8 (n, D), memmap (présélection)
+  - docs.<seg>.bin   : textes des chunks (utf-8) concaténés, lus en mmap via (offset, longueur)
+  - toks.<seg>.bin   : tokens lexicaux des chunks (séparés par des espaces), idem
+  - kv.<seg>.bin     : paires KEY: valeur des chunks (JSON, vide si aucune), idem
+  - index.<seg>.npz  : métadonnées SoA: files[], file_ids[], chunk_index[], chunk_chars[], sq_norms[],
+                       <blob>_off[] / <blob>_len[], blooms[n, 16] (uint64, bloom filter des tokens)
+  - manifest.json    : segments vivants + fichiers supprimés de chaque segment (tombstones)
+
+Un upload écrit un nouveau segment; une suppression ne réécrit que le manifest. Les fichiers d'un
+segment ne sont jamais réécrits (un fichier mappé ne peut pas être remplacé sous Windows): la compaction
+réécrit dans un nouveau segment ceux majoritairement supprimés, et fusionne les petits segments récents.
+"""
+import asyncio
+import glob
+import json
+import mmap
 import os
-from typing import List, Dict, Any, Optional
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterable, Iterable, Iterator, List, Dict, Any, FrozenSet, Optional, Set, Tuple
 
-import chromadb
-from chromadb.config import Settings
+import numpy as np
 
-from rag.ollama_client import embed_texts
+try:
+    import fcntl  # POSIX: flock
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from rag.ollama_client import EMBED_BATCH_SIZE, EMBED_WORKERS, embed_texts
+from rag.text_utils import BLOOM_WORDS, keyword_tokens, token_bloom, bloom_matrix, extract_kv_pairs
 
 # backend/rag/store.py  -> backend directory = .. (parent du dossier rag)
 BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-CHROMA_DIR = os.path.join(BACKEND_DIR, "storage", "chroma")
+FLAT_DIR = os.path.join(BACKEND_DIR, "storage", "flat")
+MANIFEST_PATH = os.path.join(FLAT_DIR, "manifest.json")
+LOCK_PATH = os.path.join(FLAT_DIR, "write.lock")
+
+os.makedirs(FLAT_DIR, exist_ok=True)
+
+RERANK_K = 200          # taille de la présélection int8 re-classée en float32
+INT8_MIN_ROWS = 10000   # en dessous, le GEMV float32 sur tous les candidats est aussi rapide (mesuré, D=768)
+_SCAN_BLOCK = 256       # lignes int8 converties par bloc: 256 x 768 float32 = 768 Kio, tient en cache L2
+_MAX_SEGMENTS = 8       # au-delà, les segments récents (petits) sont fusionnés
+_MAX_DEAD_FRAC = 0.5    # segment réécrit (lignes vivantes seules) au-delà de cette part de tombstones
+_RELOAD_TRIES = 3       # relectures du manifest si un segment disparaît pendant le rechargement
+
+_BLOBS = ("docs", "toks", "kv")
+
+
+def _seg_path(kind: str, sid: int, ext: str) -> str:
+    return os.path.join(FLAT_DIR, f"{kind}.{sid}.{ext}")
+
+
+def _open_blob(path: str) -> Any:
+    # mmap en lecture seule (un fichier vide ne peut pas être mappé)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@dataclass(frozen=True)
+class _Segment:
+    sid: int
+    files: List[str]              # file_id local -> nom de fichier
+    embs: np.ndarray              # (n, D) float32 (memmap)
+    embs_i8: np.ndarray           # (n, D) int8 (memmap), round(127 * e / ||e||)
+    arrs: Dict[str, np.ndarray]   # SoA de index.<seg>.npz
+    blobs: Dict[str, Any]         # docs / toks / kv (mmap)
+
+    @property
+    def n(self) -> int:
+        return int(self.arrs["file_ids"].shape[0])
+
+    def text(self, blob: str, i: int) -> str:
+        off = int(self.arrs[blob + "_off"][i])
+        return self.blobs[blob][off : off + int(self.arrs[blob + "_len"][i])].decode("utf-8")
+
+    def live_rows(self, dead: FrozenSet[str]) -> np.ndarray:
+        gone = [i for i, fn in enumerate(self.files) if fn in dead]
+        if not gone:
+            return np.arange(self.n)
+        return np.flatnonzero(~np.isin(self.arrs["file_ids"], np.asarray(gone, dtype=np.int32)))
+
+
+def _load_segment(sid: int) -> _Segment:
+    with np.load(_seg_path("index", sid, "npz")) as z:
+        arrs = {k: z[k] for k in z.files}
+    files = [str(fn) for fn in arrs.pop("files")]
+    return _Segment(
+        sid=sid,
+        files=files,
+        embs=np.load(_seg_path("embs", sid, "npy"), mmap_mode="r"),
+        embs_i8=np.load(_seg_path("embs8", sid, "npy"), mmap_mode="r"),
+        arrs=arrs,
+        blobs={b: _open_blob(_seg_path(b, sid, "bin")) for b in _BLOBS},
+    )
+
+
+@dataclass(frozen=True)
+class _FlatIndex:
+    segments: List[_Segment]
+    dead: Dict[int, FrozenSet[str]]   # tombstones: segment -> fichiers supprimés
+    next_sid: int
+    seg_start: np.ndarray     # (S+1,) int64, première ligne globale de chaque segment (+ total)
+    live: np.ndarray          # (N,) bool, False = ligne supprimée (tombstone)
+    sq_norms: np.ndarray      # (N,) float32, ||e||²
+    file_ids: np.ndarray      # (N,) int32 -> files[]
+    chunk_index: np.ndarray   # (N,) int32
+    blooms: np.ndarray        # (N, BLOOM_WORDS) uint64
+    files: List[str]
+    size: int                 # nombre de chunks vivants
+
+    def locate(self, i: int) -> Tuple[_Segment, int]:
+        s = int(np.searchsorted(self.seg_start, i, side="right")) - 1
+        return self.segments[s], i - int(self.seg_start[s])
+
+    def by_segment(self, rows: np.ndarray) -> Iterator[Tuple[_Segment, np.ndarray]]:
+        """
+        (segment, lignes locales) pour des lignes globales triées, dans l'ordre.
+        """
+        bounds = np.searchsorted(rows, self.seg_start)
+        for s, seg in enumerate(self.segments):
+            lo, hi = int(bounds[s]), int(bounds[s + 1])
+            if hi > lo:
+                yield seg, rows[lo:hi] - self.seg_start[s]
+
+    def doc(self, i: int) -> str:
+        seg, r = self.locate(i)
+        return seg.text("docs", r)
+
+    def meta(self, i: int) -> Dict[str, Any]:
+        seg, r = self.locate(i)
+        fn = self.files[int(self.file_ids[i])]
+        return {
+            "doc_type": os.path.splitext(fn)[1].lower().lstrip("."),
+            "chunk_chars": int(seg.arrs["chunk_chars"][r]),
+            "tokens": seg.text("toks", r),
+            "kv": seg.text("kv", r),
+            "file_name": fn,
+            "chunk_index": int(self.chunk_index[i]),
+        }
+
+
+def _assemble(segments: List[_Segment], dead: Dict[int, FrozenSet[str]], next_sid: int) -> _FlatIndex:
+    """
+    Vue globale des segments: seules les petites colonnes SoA sont concaténées, les embeddings
+    et les textes restent mappés par segment.
+    """
+    files: List[str] = []
+    file_pos: Dict[str, int] = {}
+    for seg in segments:
+        for fn in seg.files:
+            if fn not in file_pos:
+                file_pos[fn] = len(files)
+                files.append(fn)
+
+    file_ids, live = [], []
+    for seg in segments:
+        remap = np.asarray([file_pos[fn] for fn in seg.files], dtype=np.int32)
+        file_ids.append(remap[seg.arrs["file_ids"]])
+        mask = np.zeros(seg.n, dtype=bool)
+        mask[seg.live_rows(dead.get(seg.sid, frozenset()))] = True
+        live.append(mask)
+
+    def cat(parts: List[np.ndarray], empty: np.ndarray) -> np.ndarray:
+        return np.concatenate(parts) if parts else empty
+
+    live_all = cat(live, np.zeros(0, dtype=bool))
+    return _FlatIndex(
+        segments=segments,
+        dead=dead,
+        next_sid=next_sid,
+        seg_start=np.concatenate([[0], np.cumsum([seg.n for seg in segments], dtype=np.int64)]).astype(np.int64),
+        live=live_all,
+        sq_norms=cat([seg.arrs["sq_norms"] for seg in segments], np.zeros(0, dtype=np.float32)),
+        file_ids=cat(file_ids, np.zeros(0, dtype=np.int32)),
+        chunk_index=cat([seg.arrs["chunk_index"] for seg in segments], np.zeros(0, dtype=np.int32)),
+        blooms=cat([seg.arrs["blooms"] for seg in segments], np.zeros((0, BLOOM_WORDS), dtype=np.uint64)),
+        files=files,
+        size=int(live_all.sum()),
+    )
+
+
+def _read_manifest() -> Dict[str, Any]:
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            man = json.load(f)
+    except Exception:
+        man = {}
+    if "segments" not in man:
+        # absent, ou index d'un format antérieur (à ré-uploader)
+        return {"next": 0, "segments": []}
+    return man
+
+
+def _write_manifest(entries: List[Dict[str, Any]], next_sid: int) -> None:
+    man = {"next": next_sid, "segments": [{"id": e["id"], "dead": sorted(e["dead"])} for e in entries]}
+    tmp = MANIFEST_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(man, f, ensure_ascii=False)
+    os.replace(tmp, MANIFEST_PATH)
+
+
+def _load_index(prev: Optional[_FlatIndex] = None) -> _FlatIndex:
+    """
+    Charge l'index décrit par le manifest. Les segments étant immuables, ceux déjà chargés
+    dans `prev` sont réutilisés: seul ce qui a été écrit depuis est ouvert.
+    """
+    man = _read_manifest()
+    known = {seg.sid: seg for seg in prev.segments} if prev is not None else {}
+    segments = [known.get(e["id"]) or _load_segment(e["id"]) for e in man["segments"]]
+    dead = {e["id"]: frozenset(e["dead"]) for e in man["segments"]}
+    return _assemble(segments, dead, int(man["next"]))
+
+
+def _write_segment(sid: int, n: int, dim: int, parts: Iterable[Dict[str, Any]]) -> _Segment:
+    """
+    Écrit le segment `sid` (n lignes) à partir de `parts`, écrites l'une après l'autre:
+    la mémoire de pointe est celle d'une part, pas celle de l'index.
+    Part: files, file_ids, chunk_index, chunk_chars, embs (m, D), embs_i8 (ou None), blooms (m, W),
+    et pour chaque blob (docs, toks, kv): (octets concaténés, longueurs).
+    """
+    files: List[str] = []
+    file_pos: Dict[str, int] = {}
+    cols: Dict[str, List[np.ndarray]] = {
+        k: [] for k in ("file_ids", "chunk_index", "chunk_chars", "sq_norms", "blooms", *(b + "_len" for b in _BLOBS))
+    }
+    embs = np.lib.format.open_memmap(_seg_path("embs", sid, "npy"), mode="w+", dtype=np.float32, shape=(n, dim))
+    embs_i8 = np.lib.format.open_memmap(_seg_path("embs8", sid, "npy"), mode="w+", dtype=np.int8, shape=(n, dim))
+    outs = {b: open(_seg_path(b, sid, "bin"), "wb") for b in _BLOBS}
+    try:
+        row = 0
+        for p in parts:
+            e = np.asarray(p["embs"], dtype=np.float32)
+            m = e.shape[0]
+            embs[row : row + m] = e
+            embs_i8[row : row + m] = p["embs_i8"] if p.get("embs_i8") is not None else _quantize(e)
+            row += m
+
+            for fn in p["files"]:
+                if fn not in file_pos:
+                    file_pos[fn] = len(files)
+                    files.append(fn)
+            remap = np.asarray([file_pos[fn] for fn in p["files"]], dtype=np.int32)
+            cols["file_ids"].append(remap[p["file_ids"]])
+            cols["chunk_index"].append(np.asarray(p["chunk_index"], dtype=np.int32))
+            cols["chunk_chars"].append(np.asarray(p["chunk_chars"], dtype=np.int32))
+            cols["sq_norms"].append(np.einsum("ij,ij->i", e, e).astype(np.float32))
+            cols["blooms"].append(np.asarray(p["blooms"], dtype=np.uint64))
+            for b in _BLOBS:
+                data, lens = p[b]
+                outs[b].write(data)
+                cols[b + "_len"].append(np.asarray(lens, dtype=np.int64))
+        embs.flush()
+        embs_i8.flush()
+    finally:
+        for f in outs.values():
+            f.close()
+        del embs, embs_i8
+
+    arrs = {k: np.concatenate(v) for k, v in cols.items()}
+    for b in _BLOBS:
+        lens = arrs[b + "_len"]
+        off = np.zeros_like(lens)
+        if len(lens) > 1:
+            np.cumsum(lens[:-1], out=off[1:])
+        arrs[b + "_off"] = off
+    np.savez(_seg_path("index", sid, "npz"), files=np.asarray(files, dtype=str), **arrs)
+    return _load_segment(sid)
+
+
+def _segment_part(seg: _Segment, rows: np.ndarray) -> Dict[str, Any]:
+    """
+    Lignes `rows` d'un segment existant, au format part de _write_segment (compaction).
+    """
+    full = len(rows) == seg.n
+    part: Dict[str, Any] = {
+        "files": seg.files,
+        "embs": seg.embs if full else seg.embs[rows],
+        "embs_i8": seg.embs_i8 if full else seg.embs_i8[rows],
+    }
+    for k in ("file_ids", "chunk_index", "chunk_chars", "blooms"):
+        part[k] = seg.arrs[k][rows]
+    for b in _BLOBS:
+        blob, off, lens = seg.blobs[b], seg.arrs[b + "_off"][rows], seg.arrs[b + "_len"][rows]
+        data = blob[:] if full else b"".join(blob[o : o + m] for o, m in zip(off.tolist(), lens.tolist()))
+        part[b] = (data, lens)
+    return part
+
+
+def _blob_part(texts: List[str]) -> Tuple[bytes, np.ndarray]:
+    enc = [t.encode("utf-8") for t in texts]
+    return b"".join(enc), np.fromiter((len(b) for b in enc), dtype=np.int64, count=len(enc))
+
+
+def _quantize(x: np.ndarray) -> np.ndarray:
+    """
+    L2-normalise (par ligne) puis quantifie en int8: round(127 * x / ||x||).
+    """
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    unit = x / np.maximum(norms, 1e-12)
+    return np.round(unit * 127.0).astype(np.int8)
+
+
+def _int8_scores(mat: np.ndarray, q8: np.ndarray) -> np.ndarray:
+    """
+    Produits scalaires int8 (≈ cosinus * 127²), calculés par blocs: seule la matrice int8 est
+    lue en entier; chaque bloc est converti en float32 (exact pour D <= 1040) pour passer par BLAS.
+    """
+    qf = q8.astype(np.float32)
+    out = np.empty(mat.shape[0], dtype=np.float32)
+    for start in range(0, mat.shape[0], _SCAN_BLOCK):
+        blk = mat[start : start + _SCAN_BLOCK]
+        out[start : start + blk.shape[0]] = blk.astype(np.float32) @ qf
+    return out
+
+
+def _cleanup_segments(keep: Set[int], next_sid: int) -> None:
+    # best-effort: sous Windows un fichier encore mappé ne peut pas être supprimé (réessayé plus tard).
+    # Les ids >= next_sid peuvent appartenir à une écriture en cours (autre worker): jamais supprimés.
+    for path in glob.glob(os.path.join(FLAT_DIR, "*.*.*")):
+        try:
+            sid = int(os.path.basename(path).split(".")[1])
+        except ValueError:
+            continue
+        if sid < next_sid and sid not in keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def _compact(entries: List[Dict[str, Any]], by_sid: Dict[int, _Segment], next_sid: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Retire les segments entièrement supprimés, réécrit ceux dont plus de _MAX_DEAD_FRAC des lignes
+    sont supprimées, puis fusionne la queue (segments récents, plus petits) au-delà de _MAX_SEGMENTS.
+    """
+    def rows(e: Dict[str, Any]) -> np.ndarray:
+        return by_sid[e["id"]].live_rows(frozenset(e["dead"]))
+
+    def rewrite(group: List[Dict[str, Any]]) -> Dict[str, Any]:
+        nonlocal next_sid
+        sel = [(by_sid[e["id"]], rows(e)) for e in group]
+        seg = _write_segment(
+            next_sid,
+            sum(len(r) for _, r in sel),
+            sel[0][0].embs.shape[1],
+            (_segment_part(s, r) for s, r in sel),
+        )
+        by_sid[seg.sid] = seg
+        next_sid += 1
+        return {"id": seg.sid, "dead": set()}
+
+    live = [len(rows(e)) for e in entries]
+    entries = [e for e, n in zip(entries, live) if n]
+    live = [n for n in live if n]
+    for i, e in enumerate(entries):
+        if e["dead"] and live[i] < (1.0 - _MAX_DEAD_FRAC) * by_sid[e["id"]].n:
+            entries[i] = rewrite([e])
+
+    if len(entries) > _MAX_SEGMENTS:
+        start = len(entries) - 2
+        total = live[-1] + live[-2]
+        while start > 0 and live[start - 1] <= total:
+            start -= 1
+            total += live[start]
+        entries = entries[:start] + [rewrite(entries[start:])]
+    return entries, next_sid
+
+
+def _update(
+    idx: _FlatIndex,
+    drop_file: Optional[str] = None,
+    part: Optional[Dict[str, Any]] = None,
+    clear: bool = False,
+) -> None:
+    """
+    Écriture de l'index `idx` (fourni par _index_write_lock()): tombstone des chunks de `drop_file`,
+    ajout éventuel d'un segment (`part`), compaction, puis bascule du manifest.
+    """
+    global _state
+    by_sid = {seg.sid: seg for seg in idx.segments}
+    next_sid = idx.next_sid
+    entries = [] if clear else [{"id": seg.sid, "dead": set(idx.dead.get(seg.sid, ()))} for seg in idx.segments]
+
+    if drop_file is not None:
+        for e in entries:
+            if drop_file in by_sid[e["id"]].files:
+                e["dead"].add(drop_file)
+
+    if part is not None:
+        n, dim = part["embs"].shape
+        for e in entries:
+            seg = by_sid[e["id"]]
+            if seg.embs.shape[1] != dim and len(seg.live_rows(frozenset(e["dead"]))):
+                raise RuntimeError("Dimension d'embedding incompatible avec l'index existant (vider l'index).")
+        seg = _write_segment(next_sid, n, dim, [part])
+        by_sid[seg.sid] = seg
+        next_sid += 1
+        entries.append({"id": seg.sid, "dead": set()})
+
+    entries, next_sid = _compact(entries, by_sid, next_sid)
+    _write_manifest(entries, next_sid)
+    new_index = _assemble(
+        [by_sid[e["id"]] for e in entries],
+        {e["id"]: frozenset(e["dead"]) for e in entries},
+        next_sid,
+    )
+    _state = (_manifest_stamp(), new_index)
+    _cleanup_segments({e["id"] for e in entries}, next_sid)
+
+
+def _manifest_stamp() -> Optional[tuple]:
+    try:
+        st = os.stat(MANIFEST_PATH)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+_write_lock = threading.Lock()    # écritures du processus (jamais pris par les lectures)
+_reload_lock = threading.Lock()   # un seul rechargement à la fois (durée d'un _load_index)
+# (empreinte du manifest, index): remplacés ensemble; l'empreinte est lue avant le manifest,
+# donc l'index n'est jamais plus ancien qu'elle
+_state: Tuple[Optional[tuple], _FlatIndex] = (_manifest_stamp(), _load_index())
+_cleanup_segments({seg.sid for seg in _state[1].segments}, _state[1].next_sid)
+
+
+def _current() -> _FlatIndex:
+    """
+    Index courant. Avec plusieurs workers uvicorn, chaque processus a son propre index:
+    si le manifest a changé (écriture par un autre worker), les nouveaux segments sont chargés.
+    Peut ouvrir des fichiers: à appeler hors de la boucle d'événements. Une écriture en cours
+    (_write_lock) ne bloque pas les lectures.
+    """
+    global _state
+    stamp, idx = _state
+    now = _manifest_stamp()
+    if now == stamp:
+        return idx
+    with _reload_lock:
+        stamp, idx = _state
+        if now == stamp:
+            return idx
+        for _ in range(_RELOAD_TRIES):
+            try:
+                new_idx = _load_index(idx)
+            except Exception:
+                # segment supprimé par la compaction d'un autre worker entre la lecture du manifest
+                # et l'ouverture de ses fichiers: le manifest a changé, on le relit
+                now = _manifest_stamp()
+                continue
+            _state = (now, new_idx)
+            return new_idx
+    # échec persistant: l'index précédent reste servi, nouvel essai au prochain appel
+    return idx
 
-os.makedirs(CHROMA_DIR, exist_ok=True)
 
-_client = chromadb.PersistentClient(
-    path=CHROMA_DIR,
-    settings=Settings(anonymized_telemetry=False),
-)
+def _lock_file(fd: int) -> None:
+    # verrou OS exclusif et bloquant: libéré par l'OS si le processus meurt
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return
+    os.lseek(fd, 0, os.SEEK_SET)
+    while True:
+        try:
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)  # réessaie pendant ~10 s puis OSError
+            return
+        except OSError:
+            pass
 
-_collection = _client.get_or_create_collection(name="docs")
 
+def _unlock_file(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        return
+    os.lseek(fd, 0, os.SEEK_SET)
+    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
 
-def _ids_for_file(file_name: str, n: int) -> List[str]:
-    safe = file_name.replace("\\", "_").replace("/", "_")
-    return [f"{safe}::chunk::{i}" for i in range(n)]
+
+@contextmanager
+def _index_write_lock() -> Iterator[_FlatIndex]:
+    """
+    Verrou d'écriture: threads du processus (_write_lock) + autres workers (verrou OS sur write.lock).
+    Fournit l'index relu depuis le manifest sous le verrou: l'écriture part toujours du dernier état.
+    """
+    with _write_lock:
+        fd = os.open(LOCK_PATH, os.O_RDWR | os.O_CREAT)
+        try:
+            _lock_file(fd)
+            try:
+                yield _load_index(_state[1])
+            finally:
+                _unlock_file(fd)
+        finally:
+            os.close(fd)
+
+
+def _file_mask(idx: _FlatIndex, names: List[str]) -> np.ndarray:
+    wanted = set(names)
+    ids = [i for i, fn in enumerate(idx.files) if fn in wanted]
+    return np.isin(idx.file_ids, np.asarray(ids, dtype=np.int32))
+
+
+def _where_mask(idx: _FlatIndex, where: Optional[Dict[str, Any]]) -> np.ndarray:
+    """
+    Lignes vivantes, restreintes au sous-ensemble des filtres Chroma utilisés par l'API:
+      {"file_name": "a.pdf"} ou {"file_name": {"$in": ["a.pdf", "b.pdf"]}}
+    """
+    if not where:
+        return idx.live
+    cond = where.get("file_name")
+    if isinstance(cond, str):
+        return idx.live & _file_mask(idx, [cond])
+    if isinstance(cond, dict) and "$in" in cond:
+        return idx.live & _file_mask(idx, list(cond["$in"]))
+    raise ValueError(f"Filtre non supporté: {where}")
 
 
 def delete_file_chunks(file_name: str) -> int:
@@ -32,53 +533,98 @@ def delete_file_chunks(file_name: str) -> int:
     Retourne le nombre d'items supprimés.
     """
     try:
-        existing = _collection.get(where={"file_name": file_name})
-        ids = existing.get("ids") or []
-        if ids:
-            _collection.delete(ids=ids)
-            return len(ids)
+        with _index_write_lock() as idx:
+            n = int((idx.live & _file_mask(idx, [file_name])).sum())
+            if n:
+                _update(idx, drop_file=file_name)
+            return n
     except Exception:
         pass
     return 0
 
 
-def add_chunks(file_name: str, chunks: List[str]) -> int:
-    chunks = [c for c in chunks if isinstance(c, str) and c.strip()]
-    if not chunks:
+def _chunk_lexical(chunks: List[str]) -> Tuple[List[str], List[str], np.ndarray]:
+    """
+    Par chunk: tokens lexicaux (séparés par des espaces), paires KEY: valeur (JSON, "" si aucune)
+    et bloom filter des tokens (matrice (N, BLOOM_WORDS)).
+    """
+    toks, kvs, blooms = [], [], []
+    for c in chunks:
+        t = keyword_tokens(c)
+        kv = extract_kv_pairs(c)
+        toks.append(" ".join(sorted(t)))
+        kvs.append(json.dumps(kv, ensure_ascii=False) if kv else "")
+        blooms.append(token_bloom(t))
+    return toks, kvs, bloom_matrix(blooms)
+
+
+async def add_chunks(file_name: str, chunks: AsyncIterable[str]) -> int:
+    """
+    Indexe les chunks d'un fichier (remplace ceux déjà indexés pour ce fichier).
+    `chunks` est consommé au fil de l'eau (ex: chunk_text_stream via iterate_in_threadpool):
+    chaque lot de EMBED_BATCH_SIZE chunks part à l'embedding pendant que les suivants sont produits,
+    avec au plus EMBED_WORKERS lots en vol (la lecture des chunks attend le plus ancien au-delà).
+    """
+    docs: List[str] = []
+    pending: List[asyncio.Future] = []
+    batch: List[str] = []
+
+    async def submit():
+        if len(pending) >= EMBED_WORKERS:
+            await pending[-EMBED_WORKERS]
+        pending.append(asyncio.ensure_future(embed_texts(list(batch))))
+        docs.extend(batch)
+        batch.clear()
+
+    try:
+        async for c in chunks:
+            if isinstance(c, str) and c.strip():
+                batch.append(c)
+                if len(batch) >= EMBED_BATCH_SIZE:
+                    await submit()
+        if batch:
+            await submit()
+        emb_batches = await asyncio.gather(*pending)
+    except BaseException:
+        for t in pending:
+            t.cancel()
+        raise
+    if not docs:
         return 0
 
-    # overwrite par fichier
-    delete_file_chunks(file_name)
-
-    embs = embed_texts(chunks)
-    ids = _ids_for_file(file_name, len(chunks))
-
-    ext = os.path.splitext(file_name)[1].lower().lstrip(".")
-    metadatas = []
-    for i, c in enumerate(chunks):
-        metadatas.append(
-            {
-                "file_name": file_name,
-                "chunk_index": i,
-                "doc_type": ext,
-                "chunk_chars": len(c),
-            }
-        )
+    embs = np.concatenate([np.asarray(e, dtype=np.float32) for e in emb_batches])
+    toks, kvs, blooms = await asyncio.to_thread(_chunk_lexical, docs)
+    part = {
+        "files": [file_name],
+        "file_ids": np.zeros(len(docs), dtype=np.int32),
+        "chunk_index": np.arange(len(docs), dtype=np.int32),
+        "chunk_chars": np.fromiter((len(d) for d in docs), dtype=np.int32, count=len(docs)),
+        "embs": embs,
+        "embs_i8": None,
+        "blooms": blooms,
+        "docs": _blob_part(docs),
+        "toks": _blob_part(toks),
+        "kv": _blob_part(kvs),
+    }
 
-    _collection.add(
-        ids=ids,
-        documents=chunks,
-        embeddings=embs,
-        metadatas=metadatas,
-    )
-    return len(chunks)
+    # overwrite par fichier: tombstone des anciens chunks + nouveau segment (disque hors de la boucle)
+    def write() -> None:
+        with _index_write_lock() as idx:
+            _update(idx, drop_file=file_name, part=part)
+
+    await asyncio.to_thread(write)
+    return len(docs)
 
 
-def query_top_k(query: str, k: int = 5, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+async def query_top_k(query: str, k: int = 5, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
     """
     Retourne une liste triée (best-first) de hits:
-      {"doc": str, "meta": dict, "distance": float}
-    where: filtre Chroma (ex: {"file_name": {"$in": ["a.pdf","b.pdf"]}})
+      {"doc": str, "meta": dict, "distance": float, "bloom": np.ndarray}
+    distance = L2 au carré (comme la métrique "l2" par défaut de Chroma).
+    where: filtre (ex: {"file_name": {"$in": ["a.pdf","b.pdf"]}})
+    meta["tokens"]: tokens lexicaux du chunk, séparés par des espaces.
+    meta["kv"]: paires KEY: valeur du chunk en JSON ("" si aucune).
+    bloom: ligne uint64[BLOOM_WORDS] du bloom filter de ces tokens (voir text_utils.token_bloom).
     """
     q = (query or "").strip()
     if not q:
@@ -86,28 +632,70 @@ def query_top_k(query: str, k: int = 5, where: Optional[Dict[str, Any]] = None)
 
     k = max(1, int(k))
 
-    q_emb = embed_texts([q])[0]
-    res = _collection.query(
-        query_embeddings=[q_emb],
-        n_results=k,
-        where=where,
-        include=["documents", "metadatas", "distances"],
-    )
+    # _current() peut recharger l'index (fichiers): toujours hors de la boucle d'événements
+    if (await asyncio.to_thread(_current)).size == 0:
+        return []
 
-    docs = (res.get("documents") or [[]])[0]
-    metas = (res.get("metadatas") or [[]])[0]
-    dists = (res.get("distances") or [[]])[0]
+    q_emb = np.asarray((await embed_texts([q], query=True))[0], dtype=np.float32)
+    # recherche numpy (GEMV, libère le GIL) hors de la boucle d'événements
+    return await asyncio.to_thread(_search, q_emb, k, where)
 
-    if not dists:
-        dists = [None] * len(docs)
 
-    hits: List[Dict[str, Any]] = []
-    for doc, meta, dist in zip(docs, metas, dists):
-        hits.append({"doc": doc, "meta": meta, "distance": dist})
+def _search(q_emb: np.ndarray, k: int, where: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    idx = _current()
+    cand = np.flatnonzero(_where_mask(idx, where))
+    if cand.size == 0:
+        return []
+
+    # 1) présélection int8 (cosinus approché) si les candidats dépassent la fenêtre de rerank et INT8_MIN_ROWS
+    shortlist = max(k, RERANK_K)
+    if cand.size > max(shortlist, INT8_MIN_ROWS):
+        q8 = _quantize(q_emb)
+        scores = np.concatenate([
+            _int8_scores(seg.embs_i8 if len(rows) == seg.n else seg.embs_i8[rows], q8)
+            for seg, rows in idx.by_segment(cand)
+        ])
+        cand = cand[np.argpartition(-scores, shortlist - 1)[:shortlist]]
+        cand.sort()  # accès memmap croissant
 
+    # 2) rerank float32: ||e - q||² = ||e||² - 2 e·q + ||q||²
+    # produit par segment (segment entier sans copie), on ne concatène que les vecteurs de scores
+    dots = np.concatenate([
+        (seg.embs if len(rows) == seg.n else seg.embs[rows]) @ q_emb
+        for seg, rows in idx.by_segment(cand)
+    ])
+    dists = idx.sq_norms[cand] - 2.0 * dots + float(q_emb @ q_emb)
+    order = np.argsort(dists, kind="stable")[:k]
     # best-first: distance plus petite = meilleure
-    hits.sort(key=lambda h: (h["distance"] is None, h["distance"] if h["distance"] is not None else 10**9))
-    return hits
+    cand, dists = cand[order], dists[order]
+
+    return [
+        {"doc": idx.doc(int(i)), "meta": idx.meta(int(i)), "distance": float(max(d, 0.0)), "bloom": b}
+        for i, d, b in zip(cand, dists, idx.blooms[cand])
+    ]
+
+
+def query_kv_key(key: str, limit: int = 8, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Hits dont les paires KEY: valeur pré-extraites (meta "kv") contiennent `key`, dans l'ordre de l'index.
+    Aucun embedding ni recherche vectorielle: recherche de la clé dans les blobs kv mappés. "distance" vaut None.
+    """
+    idx = _current()
+    mask = _where_mask(idx, where)
+    needle = (json.dumps(key) + ":").encode("utf-8")  # clé telle qu'écrite dans le JSON "kv"
+    out: List[Dict[str, Any]] = []
+    for s, seg in enumerate(idx.segments):
+        blob, off, lens = seg.blobs["kv"], seg.arrs["kv_off"], seg.arrs["kv_len"]
+        pos = blob.find(needle)
+        while pos != -1:
+            r = int(np.searchsorted(off, pos, side="right")) - 1
+            i = int(idx.seg_start[s]) + r
+            if mask[i]:
+                out.append({"doc": idx.doc(i), "meta": idx.meta(i), "distance": None, "bloom": idx.blooms[i]})
+                if len(out) >= limit:
+                    return out
+            pos = blob.find(needle, int(off[r] + lens[r]))
+    return out
 
 
 def list_indexed_files() -> List[Dict[str, Any]]:
@@ -115,14 +703,9 @@ def list_indexed_files() -> List[Dict[str, Any]]:
     Liste les fichiers présents dans l'index + nombre de chunks.
     """
     try:
-        res = _collection.get(include=["metadatas"])
-        metas = res.get("metadatas") or []
-        counts: Dict[str, int] = {}
-        for m in metas:
-            fn = (m or {}).get("file_name")
-            if fn:
-                counts[fn] = counts.get(fn, 0) + 1
-        out = [{"file_name": k, "chunks": v} for k, v in counts.items()]
+        idx = _current()
+        counts = np.bincount(idx.file_ids[idx.live], minlength=len(idx.files))
+        out = [{"file_name": fn, "chunks": int(n)} for fn, n in zip(idx.files, counts) if n]
         out.sort(key=lambda x: x["file_name"].lower())
         return out
     except Exception:
@@ -131,14 +714,14 @@ def list_indexed_files() -> List[Dict[str, Any]]:
 
 def clear_index() -> int:
     """
-    Vide complètement la collection. Retourne le nombre d'items supprimés.
+    Vide complètement l'index. Retourne le nombre d'items supprimés.
     """
     try:
-        res = _collection.get()
-        ids = res.get("ids") or []
-        if ids:
-            _collection.delete(ids=ids)
-            return len(ids)
+        with _index_write_lock() as idx:
+            n = idx.size
+            if n:
+                _update(idx, clear=True)
+            return n
     except Exception:
         pass
     return 0
@@ -146,8 +729,6 @@ def clear_index() -> int:
 
 def count_chunks() -> int:
     try:
-        res = _collection.get()
-        ids = res.get("ids") or []
-        return len(ids)
+        return _current().size
     except Exception:
         return 0
@@ -1,5 +1,141 @@
+import os
 import re
-from typing import List
+import unicodedata
+import zlib
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+import numpy as np
+
+try:
+    MIN_KEYWORD_LEN = int(os.getenv("RAG_MIN_KW_LEN", "4").strip())  # mots >= 4, sauf exceptions ci-dessous
+except Exception:
+    MIN_KEYWORD_LEN = 4
+
+
+# ----------------------------
+# Normalization + tokenization (mots entiers)
+# ----------------------------
+def _build_fold_table() -> Dict[int, Optional[str]]:
+    """
+    Table str.translate équivalente à lower + NFKD + suppression des diacritiques
+    pour les plages latines (Latin-1, Latin étendu, ligatures).
+    Les caractères restants hors [a-z0-9] sont remplacés par un espace dans fold_text.
+    """
+    table: Dict[int, Optional[str]] = {}
+    ranges = [(0x00, 0x250), (0x1E00, 0x1F00), (0xFB00, 0xFB07)]
+    for lo, hi in ranges:
+        for cp in range(lo, hi):
+            ch = chr(cp)
+            f = unicodedata.normalize("NFKD", ch.lower())
+            f = "".join(c for c in f if not unicodedata.combining(c))
+            f = _NON_ALNUM_RE.sub(" ", f)
+            if f != ch:
+                table[cp] = f
+    # diacritiques combinants isolés (texte déjà décomposé)
+    for cp in range(0x300, 0x370):
+        table[cp] = None
+    return table
+
+
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+_FOLD_TABLE = _build_fold_table()
+
+
+def fold_text(s: str) -> str:
+    if not s:
+        return ""
+    return _NON_ALNUM_RE.sub(" ", s.translate(_FOLD_TABLE)).strip()
+
+
+_STOPWORDS_FR = frozenset({
+    "cest","c","est","qui","quoi","que","qu","de","des","du","la","le","les","un","une","et","ou","a","à",
+    "au","aux","dans","sur","pour","par","en","ce","cet","cette","ces","mon","ma","mes","ton","ta","tes","son","sa",
+    "ses","leur","leurs","avec","sans","plus","moins","d","l","y","il","elle","on","nous","vous","ils","elles",
+    "definir","donne","donner","explique","expliquer","svp","stp"
+})
+
+# exceptions courtes utiles (AJOUT tel, rag)
+_SHORT_KEEP = frozenset({"ia", "ml", "dl", "cv", "rag", "tel"})
+_SHORT_KEEP_OK = _SHORT_KEEP - _STOPWORDS_FR  # les stopwords restent exclus, même courts
+
+
+def keyword_tokens(text: str) -> Set[str]:
+    return tokens_from_folded(fold_text(text))
+
+
+def tokens_from_folded(t: str) -> Set[str]:
+    """
+    Comme keyword_tokens, pour un texte déjà passé par fold_text.
+    """
+    if not t:
+        return set()
+    # dédoublonnage d'abord (un texte répète beaucoup ses mots), puis filtres en opérations d'ensembles (C)
+    words = set(t.split())
+    toks = {w for w in words if len(w) >= MIN_KEYWORD_LEN}
+    toks -= _STOPWORDS_FR
+    toks |= words & _SHORT_KEEP_OK
+    return toks
+
+
+# ----------------------------
+# Key/value extraction (lignes "KEY: valeur")
+# ----------------------------
+KV_LINE_RE = re.compile(r"^\s*([A-Z][A-Z0-9_]{2,})\s*:\s*(.+?)\s*$")
+
+
+def extract_kv_pairs(text: str) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for line in text.splitlines():
+        m = KV_LINE_RE.match(line)
+        if m:
+            key = m.group(1).strip()
+            val = m.group(2).strip()
+            out[key] = val
+    return out
+
+
+# ----------------------------
+# Bloom filter des tokens (pré-filtre vectorisé du gate lexical)
+# ----------------------------
+BLOOM_BITS = 1024
+BLOOM_BYTES = BLOOM_BITS // 8
+BLOOM_WORDS = BLOOM_BITS // 64   # une ligne uint64[16] par chunk dans l'index
+_BLOOM_SEED = 0x9E3779B9
+
+
+def token_bloom(tokens: Iterable[str]) -> bytes:
+    """
+    Bloom filter (1024 bits, 2 hashes crc32 stables entre processus) d'un ensemble de tokens.
+    """
+    mask = 0
+    for tok in tokens:
+        b = tok.encode("utf-8")
+        mask |= 1 << (zlib.crc32(b) & (BLOOM_BITS - 1))
+        mask |= 1 << (zlib.crc32(b, _BLOOM_SEED) & (BLOOM_BITS - 1))
+    return mask.to_bytes(BLOOM_BYTES, "little")
+
+
+def bloom_matrix(blooms: Sequence[bytes]) -> np.ndarray:
+    """
+    Blooms (token_bloom) empilés en une matrice contiguë uint64 (N, BLOOM_WORDS).
+    """
+    return np.frombuffer(b"".join(blooms), dtype="<u8").reshape(len(blooms), BLOOM_WORDS)
+
+
+def bloom_may_overlap(q_bloom: bytes, blooms: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Pour chaque bloom de chunk (ligne uint64[BLOOM_WORDS]): False si aucun token de la question
+    ne peut y être présent. True = overlap possible (à confirmer par intersection exacte).
+    """
+    if not len(blooms):
+        return np.zeros(0, dtype=bool)
+    q = np.frombuffer(q_bloom, dtype="<u8")
+    return np.bitwise_and(np.stack(blooms), q).any(axis=1)
+
+
+_NEWLINE_RE = re.compile(r"\r\n?")
+_PARA_SPLIT_RE = re.compile(r"\n{2,}")
+
 
 def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[str]:
     """
@@ -10,78 +146,125 @@ def chunk_text(text: str, chunk_size: int = 1200, overlap: int = 200) -> List[st
     """
     if not isinstance(text, str):
         return []
+    return list(chunk_text_stream([text], chunk_size=chunk_size, overlap=overlap))
 
-    # Normalisation "douce" : garder les paragraphes, réduire l'excès de lignes
-    t = text.replace("\r\n", "\n").replace("\r", "\n")
-    t = re.sub(r"\n{3,}", "\n\n", t).strip()
-    if not t:
-        return []
 
+def chunk_text_stream(texts: Iterable[str], chunk_size: int = 1200, overlap: int = 200) -> Iterator[str]:
+    """
+    Version streaming de chunk_text: `texts` (ex: pages d'un PDF) est découpé exactement comme
+    "\n".join(texts), sans jamais matérialiser le texte complet. Seul le paragraphe en cours
+    est gardé en mémoire (ou sa dernière ligne incomplète s'il dépasse chunk_size).
+    """
     chunk_size = max(200, int(chunk_size))
     overlap = max(0, int(overlap))
     if overlap >= chunk_size:
         overlap = max(0, chunk_size // 5)
 
-    # 1) paragraphes
-    parts = re.split(r"\n\n+", t)
-    base_chunks: List[str] = []
+    ready: List[str] = []            # chunks de base terminés, pas encore émis
     cur = ""
+    long_buf: Optional[str] = None   # non-None: paragraphe trop long en cours (découpe par lignes)
+    prev = ""
 
     def flush():
         nonlocal cur
         if cur and cur.strip():
-            base_chunks.append(cur.strip())
+            ready.append(cur.strip())
         cur = ""
 
-    for p in parts:
+    def start_long():
+        nonlocal long_buf
+        flush()
+        long_buf = ""
+
+    def add_lines(s: str):
+        nonlocal long_buf
+        for ln in s.splitlines():
+            ln = ln.strip()
+            if not ln:
+                continue
+            if len(long_buf) + len(ln) + 1 > chunk_size:
+                if long_buf:
+                    ready.append(long_buf.strip())
+                long_buf = ln
+            else:
+                long_buf = (long_buf + "\n" + ln).strip() if long_buf else ln
+
+    def end_long():
+        nonlocal long_buf
+        if long_buf:
+            ready.append(long_buf.strip())
+        long_buf = None
+
+    def end_paragraph(p: str):
+        nonlocal cur
+        if long_buf is not None:
+            add_lines(p)
+            end_long()
+            return
+
         p = p.strip()
         if not p:
-            continue
+            return
 
         # si ajout dépasse la taille, flush
         if len(cur) + len(p) + 2 > chunk_size:
             flush()
 
-            # si paragraphe trop long, découpe lignes puis fallback caractères
+            # si paragraphe trop long, découpe par lignes
             if len(p) > chunk_size:
-                lines = [ln.strip() for ln in p.splitlines() if ln.strip()]
-                buf = ""
-                for ln in lines:
-                    if len(buf) + len(ln) + 1 > chunk_size:
-                        if buf:
-                            base_chunks.append(buf.strip())
-                        buf = ln
-                    else:
-                        buf = (buf + "\n" + ln).strip() if buf else ln
-
-                if buf:
-                    base_chunks.append(buf.strip())
+                start_long()
+                add_lines(p)
+                end_long()
             else:
                 cur = p
         else:
             cur = (cur + "\n\n" + p).strip() if cur else p
 
-    flush()
+    def emit() -> Iterator[str]:
+        # overlap glissant
+        nonlocal prev
+        for c in ready:
+            c = c.strip()
+            if not c:
+                continue
+            if overlap > 0 and prev:
+                yield (prev[-overlap:] + "\n" + c).strip()
+            else:
+                yield c
+            prev = c
+        ready.clear()
 
-    # fallback si rien
-    if not base_chunks:
-        base_chunks = [t[:chunk_size]]
+    carry = ""   # paragraphe en cours (après le dernier séparateur vu)
+    sep = None   # séparateur avant le prochain morceau (None = premier morceau)
+    for piece in texts:
+        if not isinstance(piece, str):
+            continue
+        # Normalisation "douce" : sauts de lignes unifiés; les paragraphes sont découpés
+        # sur 2+ sauts, l'excès de lignes vides disparaît donc au découpage
+        ends_cr = piece.endswith("\r")
+        piece = _NEWLINE_RE.sub("\n", piece)
+        scan_from = max(0, len(carry) - 1)
+        carry = piece if sep is None else carry + sep + piece
+        # "...\r" + "\n" (jointure) forme un seul saut de ligne "\r\n"
+        sep = "" if ends_cr else "\n"
 
-    # 2) overlap glissant
-    if overlap <= 0:
-        return [c for c in base_chunks if c.strip()]
+        seg_start = 0
+        for m in _PARA_SPLIT_RE.finditer(carry, scan_from):
+            end_paragraph(carry[seg_start : m.start()])
+            seg_start = m.end()
+        carry = carry[seg_start:]
 
-    out: List[str] = []
-    prev = ""
-    for c in base_chunks:
-        c = c.strip()
-        if not c:
-            continue
-        if prev:
-            prefix = prev[-overlap:]
-            out.append((prefix + "\n" + c).strip())
-        else:
-            out.append(c)
-        prev = c
+        # paragraphe déjà trop long: découpe par lignes au fil de l'eau, garde la ligne incomplète
+        if long_buf is None and len(carry) > chunk_size and len(carry.strip()) > chunk_size:
+            start_long()
+        if long_buf is not None:
+            cut = carry.rfind("\n")
+            if cut > 0:
+                add_lines(carry[:cut])
+                carry = carry[cut:]
 
-    return out
+        yield from emit()
+
+    end_paragraph(carry)
+    flush()
+    yield from emit()